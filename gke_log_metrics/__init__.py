@@ -1,5 +1,6 @@
 from .config import Config
 from .logger import Logger, get_logger
+from .metrics import Metrics, get_metrics, reset_metrics, set_metrics
 from .exceptions import ValidationError
 
-__all__ = ["Config", "Logger", "get_logger", "ValidationError"]
+__all__ = ["Config", "Logger", "get_logger", "Metrics", "get_metrics", "set_metrics", "reset_metrics", "ValidationError"]
@@ -2,11 +2,94 @@
 
 Reads defaults, `.configs` (environment variables format) and OS environment variables (env wins).
 """
+import functools
 import os
-from typing import Optional
+import stat
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple, Union
 
 from .exceptions import ValidationError
 
+if TYPE_CHECKING:
+    from .logger import Logger
+
+
+_TRUE = frozenset(("true", "1", "yes", "on"))
+
+
+def _parse_str(key: str, value: str) -> str:
+    return value
+
+
+def _parse_upper(key: str, value: str) -> str:
+    return value.upper()
+
+
+def _parse_bool(key: str, value: Union[str, bool]) -> bool:
+    return str(value).lower() in _TRUE
+
+
+def _parse_int(key: str, value: Union[str, int]) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"{key} must be an integer, got {value!r}")
+
+
+def _parse_float(key: str, value: Union[str, float]) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"{key} must be a number, got {value!r}")
+
+
+# (attribute, parser) applied to each default/file value or its env override
+_FIELDS: Tuple[Tuple[str, Callable[[str, Any], Any]], ...] = (
+    ("APP_NAME", _parse_str),
+    ("APP_TYPE", _parse_str),
+    ("OWNER", _parse_str),
+    ("METRICS_ENABLED", _parse_bool),
+    ("PROMETHEUS_ENABLED", _parse_bool),
+    ("LOG_LEVEL", _parse_upper),
+    ("METRICS_BUFFER_BYTES", _parse_int),
+    ("METRICS_FLUSH_INTERVAL_MS", _parse_int),
+    ("METRICS_BATCH_SIZE", _parse_int),
+    ("METRICS_FAST_PATH", _parse_bool),
+    ("METRICS_SAMPLE_RATE", _parse_float),
+)
+_KNOWN_KEYS = frozenset(key for key, _ in _FIELDS)
+
+
+def _stat_file(path: str) -> Optional[os.stat_result]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+
+@functools.lru_cache(maxsize=8)
+def _load_config_file(path: str, mtime_ns: int, size: int) -> Tuple[Tuple[str, str], ...]:
+    """Parse a KEY=VALUE config file into (key, value) pairs.
+
+    Cached by path, mtime and size so repeated `Config()` calls don't re-read
+    an unchanged file.
+    """
+    with open(path, "rb") as f:
+        lines = f.read().decode("utf-8").splitlines()
+    pairs = []
+    for line in lines:
+        line = line.strip()
+        # skip empty lines and comments
+        if not line or line[0] == '#':
+            continue
+        # parse KEY=VALUE format, keeping only settings Config knows about
+        key, sep, value = line.partition('=')
+        if sep:
+            key = key.strip()
+            if key in _KNOWN_KEYS:
+                pairs.append((key, value.strip()))
+    return tuple(pairs)
+
 
 class Config:
     def __init__(self, config_file: Optional[str] = None):
@@ -17,36 +100,43 @@ class Config:
         self.METRICS_ENABLED = True
         self.PROMETHEUS_ENABLED = False
         self.LOG_LEVEL = "INFO"
+        # stdout buffering for json_metric (0 = write every metric immediately)
+        self.METRICS_BUFFER_BYTES = 0
+        self.METRICS_FLUSH_INTERVAL_MS = 1000
+        # number of json_metric lines per stdout write (1 = write every metric immediately)
+        self.METRICS_BATCH_SIZE = 1
+        # write json_metric output straight to fd 1, bypassing sys.stdout
+        self.METRICS_FAST_PATH = False
+        # fraction of json_metric calls emitted per metric name (1.0 = all)
+        self.METRICS_SAMPLE_RATE = 1.0
+        # Logger cached by get_logger() for this config
+        self._logger: Optional["Logger"] = None
 
         # load file if provided (environment variables format: KEY=VALUE)
         cfg_path = config_file or os.getenv("CONFIG_FILE") or os.path.join(os.getcwd(), ".configs")
-        if cfg_path and os.path.isfile(cfg_path):
+        st = _stat_file(cfg_path) if cfg_path else None
+        if st is not None:
             try:
-                with open(cfg_path, "r") as f:
-                    for line in f:
-                        line = line.strip()
-                        # skip empty lines and comments
-                        if not line or line.startswith('#'):
-                            continue
-                        # parse KEY=VALUE format
-                        if '=' in line:
-                            key, value = line.split('=', 1)
-                            key = key.strip()
-                            value = value.strip()
-                            if hasattr(self, key):
-                                setattr(self, key, value)
+                pairs = _load_config_file(cfg_path, st.st_mtime_ns, st.st_size)
             except Exception as e:
                 raise ValidationError(f"Failed to read config file {cfg_path}: {e}")
+            for key, value in pairs:
+                setattr(self, key, value)
 
         # environment overrides
-        self.APP_NAME = os.getenv("APP_NAME", self.APP_NAME)
-        self.APP_TYPE = os.getenv("APP_TYPE", self.APP_TYPE)
-        self.OWNER = os.getenv("OWNER", self.OWNER)
-        self.METRICS_ENABLED = os.getenv("METRICS_ENABLED", str(self.METRICS_ENABLED)).lower() == "true"
-        self.PROMETHEUS_ENABLED = os.getenv("PROMETHEUS_ENABLED", str(self.PROMETHEUS_ENABLED)).lower() == "true"
-        self.LOG_LEVEL = os.getenv("LOG_LEVEL", self.LOG_LEVEL).upper()
+        env = os.environ
+        for key, parse in _FIELDS:
+            setattr(self, key, parse(key, env.get(key, getattr(self, key))))
 
     def validate(self) -> None:
         # currently no mandatory fields; placeholder for future rules
         if not self.APP_NAME:
             raise ValidationError("APP_NAME must be set")
+        if self.METRICS_BUFFER_BYTES < 0:
+            raise ValidationError("METRICS_BUFFER_BYTES must be >= 0")
+        if self.METRICS_FLUSH_INTERVAL_MS < 0:
+            raise ValidationError("METRICS_FLUSH_INTERVAL_MS must be >= 0")
+        if self.METRICS_BATCH_SIZE < 1:
+            raise ValidationError("METRICS_BATCH_SIZE must be >= 1")
+        if not 0 < self.METRICS_SAMPLE_RATE <= 1:
+            raise ValidationError("METRICS_SAMPLE_RATE must be in (0, 1]")
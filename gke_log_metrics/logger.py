@@ -1,74 +1,417 @@
 """Logger API: normal logs + JSON metric logs + Prometheus integration."""
 import json
 import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import weakref
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Optional
 
 from .config import Config
-from .metrics import metrics
+from .metrics import get_metrics
+
+try:
+    import orjson  # type: ignore[import-not-found]
+except ImportError:  # optional speedup; stdlib json is used otherwise
+    orjson = None  # type: ignore[assignment]
+
+
+# json_metric serializes straight to UTF-8 bytes, which is what ends up on stdout anyway.
+# orjson accepts more types than the fallback (datetime, UUID, ...) and writes NaN as null;
+# the README's [fast] section documents the difference.
+if orjson is not None:
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def _dumps(obj: Any) -> bytes:
+        # compact like orjson, so spliced lines look the same with either serializer
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+# loggers with possibly-unflushed metric buffers; flushed on SIGTERM (exit and garbage
+# collection are covered by each Logger's weakref.finalize)
+_live_loggers: "weakref.WeakSet[Logger]" = weakref.WeakSet()
+_sigterm_installed = False
+
+
+def _flush_all(blocking: bool = True) -> None:
+    for lg in list(_live_loggers):
+        lg._flush(blocking)
+
+
+def _sigterm_handler(signum: int, frame: Optional[FrameType]) -> None:
+    # flush buffered metrics before the pod goes away, then die as SIGTERM normally would.
+    # The handler may interrupt this thread while it holds a buffer or stdout lock, so the
+    # flush must not block; anything it can't get at right now is lost rather than hanging.
+    try:
+        _flush_all(blocking=False)
+    except Exception:
+        pass
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def _install_sigterm_flush() -> None:
+    """Install the SIGTERM flush handler once, unless the application already has its own."""
+    global _sigterm_installed
+    if _sigterm_installed:
+        return
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL:
+        return
+    signal.signal(signal.SIGTERM, _sigterm_handler)
+    _sigterm_installed = True
+
+
+# Prometheus counter of json_metric calls skipped by METRICS_SAMPLE_RATE
+DROPPED_METRIC = "gke_log_metrics_dropped_total"
+
+# sampling accumulator threshold, just under 1 so float drift (e.g. 10 * 0.1) doesn't skip an emit
+_SAMPLE_EMIT_AT = 1.0 - 1e-9
+
+# log() level names accepted by `level`, mirroring the stdlib logging methods
+_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "warn": logging.WARNING,
+    "error": logging.ERROR,
+    "exception": logging.ERROR,
+    "critical": logging.CRITICAL,
+    "fatal": logging.CRITICAL,
+}
+_LEVEL_NAMES = {lvl: logging.getLevelName(lvl) for lvl in set(_LEVELS.values())}
+
+# json_metric fields serialized once per Logger; `extra` may not override them
+_STATIC_KEYS = frozenset(("app_name", "app_type", "owner", "event_type"))
+
+
+def _write_fd(fd: int, data: bytes) -> None:
+    """os.write() all of `data`, retrying on short writes."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+class _ThreadBuffer:
+    """json_metric output buffered by one thread; `lock` is only contended by flush()."""
+
+    __slots__ = ("data", "lines", "batch_depth", "last_flush", "thread", "lock")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.lines = 0
+        self.batch_depth = 0
+        self.last_flush = time.monotonic()
+        self.thread = threading.current_thread()
+        self.lock = threading.Lock()
+
+    def take(self) -> bytes:
+        """Return and clear the buffered bytes; caller holds `lock`."""
+        self.last_flush = time.monotonic()
+        data = bytes(self.data)
+        self.data.clear()
+        self.lines = 0
+        return data
+
+
+def _write_stdout(data: bytes, fast_path: bool) -> None:
+    """Write `data` to stdout (fd 1 directly when `fast_path`); caller holds the logger lock."""
+    if fast_path:
+        _write_fd(1, data)
+        return
+    out = sys.stdout
+    raw = getattr(out, "buffer", None)
+    if raw is None:
+        out.write(data.decode("utf-8"))
+        out.flush()
+        return
+    # flush pending text first so metrics stay ordered with other stdout output
+    out.flush()
+    raw.write(data)
+    raw.flush()
+
+
+def _drain(buffers: List[_ThreadBuffer], lock: threading.Lock, fast_path: bool, blocking: bool) -> None:
+    """Write out and clear `buffers`, holding `lock` (a Logger's stdout lock).
+
+    Takes no Logger so it can run as the Logger's finalizer. With
+    blocking=False, buffers whose lock is held are skipped, as is everything
+    if `lock` is held.
+    """
+    if not lock.acquire(blocking):
+        return
+    try:
+        for buf in list(buffers):
+            if not buf.lock.acquire(blocking):
+                continue
+            try:
+                data = buf.take()
+            finally:
+                buf.lock.release()
+            if data:
+                _write_stdout(data, fast_path)
+    finally:
+        lock.release()
 
 
 class Logger:
+    __slots__ = (
+        "cfg", "_metrics_enabled", "_prom_enabled", "_level",
+        "_app_name", "_app_type", "_owner", "_static_json", "_ts_cache",
+        "_sample_rate", "_sample_acc",
+        "_buffered", "_max_bytes", "_max_lines", "_flush_interval", "_fast_path", "_tls", "_buffers", "_lock",
+        "__weakref__",
+    )
+
     def __init__(self, cfg: Config):
+        cfg.validate()
         self.cfg = cfg
-        self.logger = logging.getLogger("gke_log_metrics")
-        self.logger.setLevel(getattr(logging, cfg.LOG_LEVEL, logging.INFO))
-
-        # small stdout handler for normal logs
-        if not self.logger.handlers:
-            ch = logging.StreamHandler()
-            ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-            self.logger.addHandler(ch)
+        # config flags are snapshotted so hot paths read a slot instead of cfg attributes
+        self._metrics_enabled = cfg.METRICS_ENABLED
+        self._prom_enabled = cfg.PROMETHEUS_ENABLED
+        # log() writes preformatted lines to stderr itself instead of going through `logging`
+        level = getattr(logging, cfg.LOG_LEVEL, logging.INFO)
+        self._level = level if isinstance(level, int) else logging.INFO
 
         # no internal json counter anymore; json_metric receives name/value
 
+        # fields that are constant for this logger are serialized once, without braces
+        self._app_name = cfg.APP_NAME
+        self._app_type = cfg.APP_TYPE
+        self._owner = cfg.OWNER
+        self._static_json = _dumps({
+            "app_name": self._app_name,
+            "app_type": self._app_type,
+            "owner": self._owner,
+            "event_type": "metric",
+        })[1:-1]
+
+        # json_metric keeps the fraction `_sample_rate` of calls per metric name, using a
+        # per-name accumulator that emits each time it reaches 1
+        self._sample_rate = cfg.METRICS_SAMPLE_RATE
+        self._sample_acc: Dict[str, float] = {}
+
+        # (epoch second, "YYYY-MM-DDTHH:MM:SS") of the last formatted timestamp
+        self._ts_cache = (0, "")
+
+        # json_metric output buffers, one per thread: one stdout write per flush instead of per metric
+        # a limit of sys.maxsize means that trigger is off
+        self._buffered = cfg.METRICS_BUFFER_BYTES > 0 or cfg.METRICS_BATCH_SIZE > 1
+        self._max_bytes = cfg.METRICS_BUFFER_BYTES if cfg.METRICS_BUFFER_BYTES > 0 else sys.maxsize
+        self._max_lines = cfg.METRICS_BATCH_SIZE if cfg.METRICS_BATCH_SIZE > 1 else sys.maxsize
+        self._flush_interval = cfg.METRICS_FLUSH_INTERVAL_MS / 1000.0
+        self._fast_path = cfg.METRICS_FAST_PATH
+        self._tls = threading.local()
+        self._buffers: List[_ThreadBuffer] = []
+        # guards self._buffers and writes to stdout
+        self._lock = threading.Lock()
+        # write out whatever is still buffered when this Logger is collected or at exit
+        weakref.finalize(self, _drain, self._buffers, self._lock, self._fast_path, True)
+        if self._buffered:
+            _live_loggers.add(self)
+            _install_sigterm_flush()
+
     def log(self, message: str, info: Optional[Dict[str, Any]] = None, level: str = "info", extra: Optional[Dict[str, Any]] = None, app_name: Optional[str] = None, app_type: Optional[str] = None) -> None:
-        """Normal application log that follows LOG_LEVEL."""
-        log_method = getattr(self.logger, level.lower(), self.logger.info)
+        """Normal application log that follows LOG_LEVEL, written to stderr.
+
+        With level="exception", the traceback of the exception being handled is
+        appended, as `logging.Logger.exception()` does.
+        """
+        lvl = _LEVELS.get(level.lower(), logging.INFO)
+        if lvl < self._level:
+            return
+        prefix = f"{self._timestamp()} - {_LEVEL_NAMES[lvl]} - {message}"
         if extra:
-            log_method(f"{message} | extra={extra} | info={info}")
+            line = f"{prefix} | extra={extra} | info={info}\n"
         else:
-            log_method(f"{message} | info={info}")
+            line = f"{prefix} | info={info}\n"
+        # like logging.Logger.exception(): append the traceback being handled, if any
+        if level.lower() == "exception" and sys.exc_info()[0] is not None:
+            line += traceback.format_exc()
+        sys.stderr.write(line)
 
-    def json_metric(self, name: str, value: float = 1.0, info: Optional[Dict[str, Any]] = None, app_name: Optional[str] = None, app_type: Optional[str] = None, extra: Optional[Dict[str, Any]] = None, message: Optional[str] = None) -> None:
+    def json_metric(self, name: str, value: float = 1.0, info: Optional[Dict[str, Any]] = None, app_name: Optional[str] = None, app_type: Optional[str] = None, extra: Optional[Dict[str, Any]] = None, message: Optional[str] = None, labels: Optional[Dict[str, str]] = None) -> None:
         """Emit a log-based metric as JSON to STDOUT.
 
         Signature mirrors `prometheus_metric` by accepting `name` and `value`.
         If `METRICS_ENABLED` in config is True, this will be printed regardless
         of `LOG_LEVEL`.
         """
-        if not self.cfg.METRICS_ENABLED:
+        if not self._metrics_enabled:
             return
 
-        entry = {
+        rate = self._sample_rate
+        if rate < 1.0:
+            # shed load before any encoding work; the first call per name is always kept
+            acc = self._sample_acc.get(name, 1.0 - rate) + rate
+            if acc < _SAMPLE_EMIT_AT:
+                self._sample_acc[name] = acc
+                get_metrics().increment(DROPPED_METRIC)
+                return
+            self._sample_acc[name] = acc - 1.0
+
+        entry: Dict[str, Any] = {
             "info": info or {},
-            "app_name": app_name or self.cfg.APP_NAME,
-            "app_type": app_type or self.cfg.APP_TYPE,
-            "owner": self.cfg.OWNER,
             # include metric identification and value
             "metric_name": name,
             "metric_value": value,
-            "event_type": "metric",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": self._timestamp(),
         }
 
         # optional human message
         if message:
             entry["message"] = message
 
+        if labels:
+            entry["labels"] = labels
+
         if extra:
             for k, v in extra.items():
-                if k in entry:
+                if k in entry or k in _STATIC_KEYS:
                     continue
                 entry[k] = v
 
-        # Print to stdout for log-based metrics ingestion
-        print(json.dumps(entry))
+        if (not app_name or app_name == self._app_name) and (not app_type or app_type == self._app_type):
+            # common case: splice the pre-serialized constant fields in front of the per-call ones
+            line = b"{" + self._static_json + b"," + _dumps(entry)[1:] + b"\n"
+        else:
+            entry["app_name"] = app_name or self._app_name
+            entry["app_type"] = app_type or self._app_type
+            entry["owner"] = self._owner
+            entry["event_type"] = "metric"
+            line = _dumps(entry) + b"\n"
+
+        # Write to stdout for log-based metrics ingestion
+        self._write(line)
+
+    def _timestamp(self) -> str:
+        """UTC ISO-8601 timestamp with microseconds, same shape as `datetime.isoformat()`.
+
+        The date/time part is formatted once per second; only the fraction is
+        rendered per call.
+        """
+        now = time.time()
+        sec = int(now)
+        cached_sec, prefix = self._ts_cache
+        if sec != cached_sec:
+            prefix = datetime.fromtimestamp(sec, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+            self._ts_cache = (sec, prefix)
+        return f"{prefix}.{int((now - sec) * 1e6):06d}+00:00"
+
+    def _write(self, line: bytes) -> None:
+        """Write a line to stdout, buffering it when METRICS_BUFFER_BYTES > 0,
+        METRICS_BATCH_SIZE > 1 or inside `batch()`.
+
+        Each thread appends to its own buffer, which is flushed once it holds
+        METRICS_BUFFER_BYTES bytes or METRICS_BATCH_SIZE lines, or when
+        METRICS_FLUSH_INTERVAL_MS has elapsed since its last flush (checked on
+        each call; there is no background thread). Whenever a thread flushes,
+        other threads' buffers older than METRICS_FLUSH_INTERVAL_MS are written
+        too, so metrics from idle or finished threads are not held indefinitely.
+        Threads therefore only contend for stdout once per flushed chunk.
+        """
+        buf = getattr(self._tls, "buf", None)
+        if not self._buffered and (buf is None or not buf.batch_depth):
+            if self._fast_path:
+                _write_fd(1, line)
+                return
+            # let sys.stdout do its own buffering; ASCII/UTF-8 decode is a plain copy
+            sys.stdout.write(line.decode("utf-8"))
+            return
+
+        if buf is None:
+            buf = self._thread_buffer()
+        with buf.lock:
+            buf.data += line
+            buf.lines += 1
+            if buf.batch_depth:
+                return
+            if (
+                buf.lines < self._max_lines
+                and len(buf.data) < self._max_bytes
+                and time.monotonic() - buf.last_flush < self._flush_interval
+            ):
+                return
+            data = buf.take()
+        self._emit(data, buf)
+
+    def _thread_buffer(self) -> "_ThreadBuffer":
+        buf = getattr(self._tls, "buf", None)
+        if buf is None:
+            buf = self._tls.buf = _ThreadBuffer()
+            with self._lock:
+                # write out and forget buffers of finished threads
+                # (in place: the finalizer holds this list)
+                live = []
+                for b in self._buffers:
+                    if b.thread.is_alive():
+                        live.append(b)
+                        continue
+                    with b.lock:
+                        data = b.take()
+                    if data:
+                        _write_stdout(data, self._fast_path)
+                self._buffers[:] = live
+                self._buffers.append(buf)
+        return buf
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Hold json_metric output inside the block and write it with one flush on exit.
+
+        Batching is per thread. Batches may be nested; output is written when
+        the outermost one exits.
+        """
+        buf = self._thread_buffer()
+        with buf.lock:
+            buf.batch_depth += 1
+        _live_loggers.add(self)
+        try:
+            yield
+        finally:
+            with buf.lock:
+                buf.batch_depth -= 1
+                data = b"" if buf.batch_depth else buf.take()
+            if data:
+                self._emit(data, buf)
+
+    def flush(self) -> None:
+        """Write any buffered metric lines, from all threads, to stdout."""
+        self._flush(True)
+
+    def _flush(self, blocking: bool) -> None:
+        """Drain every thread's buffer to stdout.
+
+        With blocking=False (used from the SIGTERM handler) buffers whose lock
+        is held are skipped, as is the whole logger if stdout is being written.
+        """
+        _drain(self._buffers, self._lock, self._fast_path, blocking)
+
+    def _emit(self, data: bytes, own: _ThreadBuffer) -> None:
+        """Write `data` flushed from `own`, preceded by other threads' overdue buffers."""
+        with self._lock:
+            now = time.monotonic()
+            for buf in self._buffers:
+                if buf is own or not buf.data or now - buf.last_flush < self._flush_interval:
+                    continue
+                with buf.lock:
+                    stale = b"" if buf.batch_depth else buf.take()
+                if stale:
+                    _write_stdout(stale, self._fast_path)
+            _write_stdout(data, self._fast_path)
 
     def prometheus_metric(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
         """Update internal Prometheus-style metrics."""
         # For simplicity, treat all as counters when incrementing
-        metrics.increment(name, int(value))
+        get_metrics().increment(name, int(value))
 
     def metric(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None, message: Optional[str] = None, info: Optional[Dict[str, Any]] = None, extra: Optional[Dict[str, Any]] = None, app_name: Optional[str] = None, app_type: Optional[str] = None) -> None:
         """Unified metric API: updates Prometheus metrics and emits JSON log-based metric.
@@ -77,27 +420,34 @@ class Logger:
         - If PROMETHEUS_ENABLED: update internal Prometheus metrics.
         - If METRICS_ENABLED: emit JSON metric to STDOUT.
         """
-        if self.cfg.PROMETHEUS_ENABLED:
+        if self._prom_enabled:
             # update prometheus-style metric
             self.prometheus_metric(name, value, labels=labels)
 
-        if self.cfg.METRICS_ENABLED:
-            # build extra payload and call json_metric with name/value
-            extra2 = extra or {}
-            # include labels and other metadata
-            if labels:
-                extra2.setdefault("labels", labels)
-            # pass optional human message through
-            # determine effective app_name/app_type using config defaults when None
-            effective_app_name = app_name or self.cfg.APP_NAME
-            effective_app_type = app_type or self.cfg.APP_TYPE
-
-            self.json_metric(name, value, info=info, extra=extra2, app_name=effective_app_name, app_type=effective_app_type, message=message)
+        if self._metrics_enabled:
+            # json_metric applies the config app_name/app_type defaults and adds labels itself
+            self.json_metric(name, value, info=info, extra=extra, app_name=app_name, app_type=app_type, message=message, labels=labels)
 
     def metrics_to_prometheus(self) -> str:
-        return metrics.to_prometheus()
+        return get_metrics().to_prometheus()
+
+    def metrics_to_prometheus_bytes(self) -> bytes:
+        return get_metrics().to_prometheus_bytes()
+
+
+_get_logger_lock = threading.Lock()
 
 
 def get_logger(cfg: Config) -> Logger:
-    cfg.validate()
-    return Logger(cfg)
+    """Return the Logger for `cfg`, validating the config and creating it on first use.
+
+    Repeated calls with the same Config return the same Logger, so changes made
+    to the Config after the first call are not picked up.
+    """
+    lg = cfg._logger
+    if lg is None:
+        with _get_logger_lock:
+            lg = cfg._logger
+            if lg is None:
+                lg = cfg._logger = Logger(cfg)
+    return lg
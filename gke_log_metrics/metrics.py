@@ -1,42 +1,169 @@
 """Simple in-process metrics collector and Prometheus exporter."""
-from typing import Dict, List
+from collections import Counter, defaultdict
+from contextvars import ContextVar, Token
+from types import MappingProxyType
+from typing import Counter as CounterT, DefaultDict, Dict, List, Mapping, Tuple
+
+
+def _new_histogram() -> List[float]:
+    return [0, 0.0]
+
+
+def _sorted_names(names: List[str], d: Mapping[str, object]) -> List[str]:
+    """Return `names` if it still holds exactly the keys of `d`, else the keys freshly sorted."""
+    if len(names) == len(d) and d.keys() == set(names):
+        return names
+    return sorted(d)
 
 
 class Metrics:
+    __slots__ = (
+        "_counters", "_gauges", "_histograms", "_counters_view", "_gauges_view", "_histograms_view",
+        "_counter_heads", "_gauge_heads", "_histogram_heads",
+        "_counter_names", "_gauge_names", "_histogram_names",
+        "_dirty", "_exposition",
+    )
+
     def __init__(self):
-        self.counters: Dict[str, int] = {}
-        self.gauges: Dict[str, float] = {}
-        self.histograms: Dict[str, List[float]] = {}
+        self._counters: CounterT[str] = Counter()
+        self._gauges: Dict[str, float] = {}
+        # running [count, sum] per histogram; individual samples are not kept
+        self._histograms: DefaultDict[str, List[float]] = defaultdict(_new_histogram)
+        # read-only views handed out by the properties below, so every update goes
+        # through the methods and invalidates the cached exposition
+        self._counters_view = MappingProxyType(self._counters)
+        self._gauges_view = MappingProxyType(self._gauges)
+        self._histograms_view = MappingProxyType(self._histograms)
+        # encoded "# HELP ...\n# TYPE ...\n<name> " prefix per metric, built on first export
+        self._counter_heads: Dict[str, bytes] = {}
+        self._gauge_heads: Dict[str, bytes] = {}
+        # (header + "<name>_count ", "\n<name>_sum ") per histogram
+        self._histogram_heads: Dict[str, Tuple[bytes, bytes]] = {}
+        # sorted metric names, re-sorted when the dicts' key sets change
+        self._counter_names: List[str] = []
+        self._gauge_names: List[str] = []
+        self._histogram_names: List[str] = []
+        # last exposition, reused until a metric is updated or reset()
+        self._dirty = True
+        self._exposition = b""
+
+    @property
+    def counters(self) -> Mapping[str, int]:
+        """Read-only view of the counters; update them with `increment()`."""
+        return self._counters_view
+
+    @property
+    def gauges(self) -> Mapping[str, float]:
+        """Read-only view of the gauges; update them with `set_gauge()`."""
+        return self._gauges_view
+
+    @property
+    def histograms(self) -> Mapping[str, List[float]]:
+        """Read-only view of the running [count, sum] per histogram; update with `record_histogram()`.
+
+        The [count, sum] lists are live and must not be modified.
+        """
+        return self._histograms_view
 
     def increment(self, name: str, value: int = 1) -> None:
-        self.counters[name] = self.counters.get(name, 0) + int(value)
+        # callers pass ints; Logger.prometheus_metric casts at the API boundary
+        self._counters[name] += value
+        self._dirty = True
 
     def set_gauge(self, name: str, value: float) -> None:
-        self.gauges[name] = float(value)
+        self._gauges[name] = float(value)
+        self._dirty = True
 
     def record_histogram(self, name: str, value: float) -> None:
-        self.histograms.setdefault(name, []).append(float(value))
+        rec = self._histograms[name]
+        rec[0] += 1
+        rec[1] += float(value)
+        self._dirty = True
+
+    def reset(self) -> None:
+        """Drop all recorded metrics."""
+        self._counters.clear()
+        self._gauges.clear()
+        self._histograms.clear()
+        self._dirty = True
 
     def to_prometheus(self) -> str:
-        lines: List[str] = []
-        for k, v in self.counters.items():
-            lines.append(f"# HELP {k} Counter metric")
-            lines.append(f"# TYPE {k} counter")
-            lines.append(f"{k} {v}")
-
-        for k, v in self.gauges.items():
-            lines.append(f"# HELP {k} Gauge metric")
-            lines.append(f"# TYPE {k} gauge")
-            lines.append(f"{k} {v}")
-
-        for k, vals in self.histograms.items():
-            if vals:
-                lines.append(f"# HELP {k} Histogram metric")
-                lines.append(f"# TYPE {k} histogram")
-                lines.append(f"{k}_count {len(vals)}")
-                lines.append(f"{k}_sum {sum(vals)}")
-        return "\n".join(lines)
+        return self.to_prometheus_bytes().decode("utf-8")
+
+    def to_prometheus_bytes(self) -> bytes:
+        """Prometheus text exposition as UTF-8 bytes, ready for an HTTP response body.
+
+        Metrics are emitted sorted by name within each type. The result is
+        cached and returned as-is until a metric is updated.
+        """
+        if not self._dirty:
+            return self._exposition
+        # cleared before reading so an update racing with this export marks it dirty again
+        self._dirty = False
+
+        buf = bytearray()
+        counters = self._counters
+        self._counter_names = _sorted_names(self._counter_names, counters)
+        heads = self._counter_heads
+        for k in self._counter_names:
+            head = heads.get(k)
+            if head is None:
+                head = heads[k] = f"# HELP {k} Counter metric\n# TYPE {k} counter\n{k} ".encode("utf-8")
+            buf += head
+            buf += str(counters[k]).encode("ascii")
+            buf += b"\n"
+
+        gauges = self._gauges
+        self._gauge_names = _sorted_names(self._gauge_names, gauges)
+        heads = self._gauge_heads
+        for k in self._gauge_names:
+            head = heads.get(k)
+            if head is None:
+                head = heads[k] = f"# HELP {k} Gauge metric\n# TYPE {k} gauge\n{k} ".encode("utf-8")
+            buf += head
+            buf += str(gauges[k]).encode("ascii")
+            buf += b"\n"
+
+        histograms = self._histograms
+        self._histogram_names = _sorted_names(self._histogram_names, histograms)
+        hist_heads = self._histogram_heads
+        for k in self._histogram_names:
+            count, total = histograms[k]
+            if not count:
+                # created by a plain read of the defaultdict; nothing observed yet
+                continue
+            pair = hist_heads.get(k)
+            if pair is None:
+                pair = hist_heads[k] = (
+                    f"# HELP {k} Histogram metric\n# TYPE {k} histogram\n{k}_count ".encode("utf-8"),
+                    f"\n{k}_sum ".encode("utf-8"),
+                )
+            buf += pair[0]
+            buf += str(count).encode("ascii")
+            buf += pair[1]
+            buf += str(total).encode("ascii")
+            buf += b"\n"
+
+        self._exposition = bytes(buf)
+        return self._exposition
 
 
 # global instance
 metrics = Metrics()
+
+# collector used by Logger; the global instance unless overridden for the current context
+_metrics_var: "ContextVar[Metrics]" = ContextVar("gke_log_metrics_metrics", default=metrics)
+
+
+def get_metrics() -> Metrics:
+    """Return the Metrics collector for the current context (the global `metrics` by default)."""
+    return _metrics_var.get()
+
+
+def set_metrics(collector: Metrics) -> "Token[Metrics]":
+    """Use `collector` in the current context; pass the returned token to `reset_metrics` to undo."""
+    return _metrics_var.set(collector)
+
+
+def reset_metrics(token: "Token[Metrics]") -> None:
+    _metrics_var.reset(token)
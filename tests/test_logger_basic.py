@@ -1,11 +1,23 @@
 import os
 import sys
+import gc
 import json
+import threading
+import time
 import pytest
+from datetime import datetime, timedelta
 
 sys.path.insert(0, os.path.abspath('.'))
 
-from gke_log_metrics import Config, get_logger, ValidationError
+from gke_log_metrics import Config, Logger, get_logger, ValidationError
+from gke_log_metrics.logger import DROPPED_METRIC
+from gke_log_metrics.metrics import Metrics, get_metrics, metrics, reset_metrics, set_metrics
+
+
+@pytest.fixture(autouse=True)
+def no_sigterm_flush(monkeypatch):
+    """Keep buffered Loggers from replacing the test process's SIGTERM handler."""
+    monkeypatch.setattr('gke_log_metrics.logger._sigterm_installed', True)
 
 
 def test_json_metric_prints_when_enabled(capsys, monkeypatch):
@@ -27,6 +39,7 @@ def test_json_metric_prints_when_enabled(capsys, monkeypatch):
     assert obj['app_name'] == 'default_app'
     assert obj['owner'] == 'default_owner'
     assert obj['event_type'] == 'metric'
+    assert datetime.fromisoformat(obj['timestamp']).utcoffset() == timedelta(0)
 
 
 def test_json_metric_not_prints_when_disabled(capsys, monkeypatch):
@@ -158,3 +171,403 @@ def test_metrics_counter_increments(capsys, monkeypatch):
     assert obj1['owner'] == 'default_owner'
     assert obj2['owner'] == 'default_owner'
     assert obj3['owner'] == 'default_owner'
+
+
+def test_json_metric_buffered_until_flush(capsys, monkeypatch):
+    """Verify buffered json_metric output is held until the buffer is flushed."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_BUFFER_BYTES', '65536')
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL_MS', '60000')
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    logger.json_metric('m', 1.0)
+    logger.json_metric('m', 2.0)
+    assert capsys.readouterr().out == ''
+
+    logger.flush()
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert [json.loads(l)['metric_value'] for l in lines] == [1.0, 2.0]
+
+
+def test_json_metric_app_override_and_reserved_extra(capsys, monkeypatch):
+    """Verify per-call app overrides apply and extra cannot replace fixed fields."""
+    monkeypatch.delenv('APP_NAME', raising=False)
+    monkeypatch.delenv('OWNER', raising=False)
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    logger.json_metric('m', 1.0, extra={'owner': 'x', 'event_type': 'x', 'k': 'v'})
+    obj = json.loads(capsys.readouterr().out.strip())
+    assert obj['owner'] == 'default_owner'
+    assert obj['event_type'] == 'metric'
+    assert obj['k'] == 'v'
+
+    logger.json_metric('m', 1.0, app_name='other_app', app_type='other_type')
+    obj = json.loads(capsys.readouterr().out.strip())
+    assert obj['app_name'] == 'other_app'
+    assert obj['app_type'] == 'other_type'
+    assert obj['owner'] == 'default_owner'
+
+
+def test_config_file_reloaded_when_changed(tmp_path, monkeypatch):
+    """Verify a cached config file is re-read after it changes."""
+    cfg_file = tmp_path / ".configs"
+    cfg_file.write_text("APP_NAME=first")
+    monkeypatch.delenv('APP_NAME', raising=False)
+    assert Config(config_file=str(cfg_file)).APP_NAME == 'first'
+
+    cfg_file.write_text("APP_NAME=second_value")
+    assert Config(config_file=str(cfg_file)).APP_NAME == 'second_value'
+
+
+def test_batch_writes_once_on_exit(capsys, monkeypatch):
+    """Verify metrics emitted inside batch() are written when the block exits."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.delenv('METRICS_BUFFER_BYTES', raising=False)
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    with logger.batch():
+        for i in range(3):
+            logger.json_metric('m', float(i))
+        assert capsys.readouterr().out == ''
+
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert [json.loads(l)['metric_value'] for l in lines] == [0.0, 1.0, 2.0]
+
+
+def test_histogram_exports_count_and_sum():
+    """Verify histograms export running _count and _sum."""
+    m = Metrics()
+    m.record_histogram('latency', 1)
+    m.record_histogram('latency', 2.5)
+    prom = m.to_prometheus()
+
+    assert 'latency_count 2' in prom
+    assert 'latency_sum 3.5' in prom
+
+
+def test_log_below_level_skips_formatting(capsys, monkeypatch):
+    """Verify log() below LOG_LEVEL neither writes nor formats its arguments."""
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    class Loud:
+        def __repr__(self):
+            raise AssertionError("formatted a disabled log call")
+
+    logger.log('quiet', info={'obj': Loud()}, level='info')
+    logger.log('loud', info={'k': 1}, level='error')
+    err = capsys.readouterr().err
+    assert 'quiet' not in err
+    assert ' - ERROR - loud | info=' in err
+
+
+def test_metric_does_not_mutate_caller_extra(capsys, monkeypatch):
+    """Verify metric() adds labels to the output without touching the caller's extra dict."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    extra = {'k': 'v'}
+    logger.metric('m', 1, labels={'job': 'j1'}, extra=extra)
+    obj = json.loads(capsys.readouterr().out.strip())
+
+    assert obj['labels'] == {'job': 'j1'}
+    assert obj['k'] == 'v'
+    assert extra == {'k': 'v'}
+
+
+def test_config_file_ignores_unknown_keys(tmp_path, monkeypatch):
+    """Verify only known settings are taken from the config file."""
+    cfg_file = tmp_path / ".configs"
+    cfg_file.write_text("# comment\n\nAPP_TYPE = gke_job\nvalidate=oops\nNOT_A_SETTING=1\nno_equals_line\n")
+    monkeypatch.delenv('APP_TYPE', raising=False)
+    cfg = Config(config_file=str(cfg_file))
+
+    assert cfg.APP_TYPE == 'gke_job'
+    assert not hasattr(cfg, 'NOT_A_SETTING')
+    cfg.validate()
+
+
+def test_buffered_metrics_from_threads_all_flushed(capsys, monkeypatch):
+    """Verify per-thread metric buffers are all written by flush()."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_BUFFER_BYTES', '65536')
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL_MS', '60000')
+    cfg = Config()
+    logger = get_logger(cfg)
+    # keep every thread alive until all have emitted: finished threads' buffers are drained early
+    barrier = threading.Barrier(4)
+
+    def emit(n):
+        for i in range(50):
+            logger.json_metric(f't{n}', float(i))
+        barrier.wait()
+
+    threads = [threading.Thread(target=emit, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert capsys.readouterr().out == ''
+
+    logger.flush()
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert len(lines) == 200
+    for n in range(4):
+        values = [o['metric_value'] for o in map(json.loads, lines) if o['metric_name'] == f't{n}']
+        assert values == [float(i) for i in range(50)]
+
+
+def test_fast_path_writes_to_fd(capfd, monkeypatch):
+    """Verify METRICS_FAST_PATH writes JSON metrics directly to file descriptor 1."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_FAST_PATH', 'true')
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    logger.json_metric('fast', 2.0)
+    obj = json.loads(capfd.readouterr().out.strip())
+    assert obj['metric_name'] == 'fast'
+    assert obj['metric_value'] == 2.0
+
+
+def test_sample_rate_drops_and_counts(capsys, monkeypatch):
+    """Verify METRICS_SAMPLE_RATE keeps 1 in N metrics per name and counts the rest."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_SAMPLE_RATE', '0.25')
+    cfg = Config()
+    logger = get_logger(cfg)
+    dropped_before = metrics.counters[DROPPED_METRIC]
+
+    for i in range(8):
+        logger.json_metric('sampled', float(i))
+    lines = capsys.readouterr().out.strip().splitlines()
+
+    assert [json.loads(l)['metric_value'] for l in lines] == [0.0, 4.0]
+    assert metrics.counters[DROPPED_METRIC] - dropped_before == 6
+
+
+def test_sample_rate_validated(monkeypatch):
+    """Verify an out-of-range METRICS_SAMPLE_RATE is rejected."""
+    monkeypatch.setenv('METRICS_SAMPLE_RATE', '0')
+    with pytest.raises(ValidationError):
+        get_logger(Config())
+
+
+def test_get_logger_reuses_logger_per_config():
+    """Verify get_logger returns one Logger per Config instance."""
+    cfg = Config()
+    assert get_logger(cfg) is get_logger(cfg)
+    assert get_logger(Config()) is not get_logger(cfg)
+
+
+def test_prometheus_bytes_matches_text():
+    """Verify the bytes exposition matches the text one."""
+    m = Metrics()
+    m.increment('jobs_total', 3)
+    m.set_gauge('queue_depth', 4)
+    m.record_histogram('latency', 0.5)
+
+    assert m.to_prometheus_bytes() == m.to_prometheus().encode('utf-8')
+    assert m.to_prometheus_bytes().endswith(b'latency_sum 0.5\n')
+
+
+def test_batch_size_flushes_every_n_metrics(capsys, monkeypatch):
+    """Verify METRICS_BATCH_SIZE writes metrics in groups of N lines."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_BATCH_SIZE', '3')
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL_MS', '60000')
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    logger.json_metric('m', 1.0)
+    logger.json_metric('m', 2.0)
+    assert capsys.readouterr().out == ''
+
+    logger.json_metric('m', 3.0)
+    assert len(capsys.readouterr().out.strip().splitlines()) == 3
+
+
+def test_set_metrics_isolates_collector(monkeypatch):
+    """Verify set_metrics routes Prometheus updates to a context-local collector."""
+    monkeypatch.setenv('PROMETHEUS_ENABLED', 'true')
+    monkeypatch.setenv('METRICS_ENABLED', 'false')
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    local = Metrics()
+    token = set_metrics(local)
+    try:
+        logger.metric('isolated_total', 2)
+        assert get_metrics() is local
+        assert local.counters['isolated_total'] == 2
+        assert 'isolated_total' not in metrics.counters
+    finally:
+        reset_metrics(token)
+    assert get_metrics() is metrics
+
+
+def test_prometheus_output_sorted_and_refreshed():
+    """Verify exposition is sorted by name and reflects updates after being cached."""
+    m = Metrics()
+    m.increment('b_total')
+    m.increment('a_total')
+    first = m.to_prometheus()
+    assert first.index('a_total 1') < first.index('b_total 1')
+    assert m.to_prometheus() == first
+
+    m.increment('a_total', 2)
+    assert 'a_total 3' in m.to_prometheus()
+
+
+def test_nonblocking_flush_skips_held_buffer(capsys, monkeypatch):
+    """Verify the signal-handler flush skips a buffer whose lock is held instead of hanging."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_BATCH_SIZE', '10')
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL_MS', '60000')
+    logger = get_logger(Config())
+
+    logger.json_metric('held', 1.0)
+    buf = logger._tls.buf
+    with buf.lock:
+        logger._flush(False)
+        assert capsys.readouterr().out == ''
+    logger._flush(False)
+    assert json.loads(capsys.readouterr().out)['metric_name'] == 'held'
+
+
+def test_buffered_metrics_flushed_when_logger_collected(capsys, monkeypatch):
+    """Verify buffered metrics are written when an unreferenced Logger is garbage-collected."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_BATCH_SIZE', '5')
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL_MS', '60000')
+
+    for i in range(3):
+        get_logger(Config()).json_metric('req', float(i))
+    gc.collect()
+
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert sorted(json.loads(l)['metric_value'] for l in lines) == [0.0, 1.0, 2.0]
+
+
+def test_prometheus_export_after_reset_and_direct_writes_rejected():
+    """Verify exports reflect reset() and the metric dicts cannot be written around the cache."""
+    m = Metrics()
+    m.set_gauge('a', 1)
+    m.increment('c_total')
+    assert 'c_total 1' in m.to_prometheus()
+
+    with pytest.raises(TypeError):
+        m.counters['c_total'] = 10  # type: ignore[index]
+    assert m.counters['c_total'] == 1
+    assert m.counters['missing'] == 0
+
+    m.reset()
+    m.set_gauge('b', 2)
+    prom = m.to_prometheus()
+    assert 'b 2.0' in prom
+    assert 'c_total' not in prom
+    assert '\na ' not in prom
+
+    m.reset()
+    assert m.to_prometheus() == ''
+
+
+@pytest.mark.parametrize('rate, calls, emitted', [('0.4', 10, 4), ('0.6', 10, 6), ('0.7', 10, 7), ('0.1', 30, 3)])
+def test_sample_rate_emits_requested_fraction(capsys, monkeypatch, rate, calls, emitted):
+    """Verify METRICS_SAMPLE_RATE emits that fraction of calls, not a rounded 1-in-N."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_SAMPLE_RATE', rate)
+    logger = get_logger(Config())
+
+    for i in range(calls):
+        logger.json_metric('frac', float(i))
+    assert len(capsys.readouterr().out.strip().splitlines()) == emitted
+
+
+def test_logger_constructor_validates_config(monkeypatch):
+    """Verify Logger(cfg) rejects an invalid config without going through get_logger."""
+    monkeypatch.setenv('METRICS_SAMPLE_RATE', '0')
+    with pytest.raises(ValidationError):
+        Logger(Config())
+
+
+def test_empty_histogram_not_exported():
+    """Verify a histogram entry created by a read, with no observations, is not exported."""
+    m = Metrics()
+    m.histograms['untouched']
+    m.record_histogram('seen', 1)
+    prom = m.to_prometheus()
+
+    assert 'untouched' not in prom
+    assert 'seen_count 1' in prom
+
+
+def test_idle_and_finished_thread_buffers_flushed(capsys, monkeypatch):
+    """Verify metrics from idle or finished threads do not wait for an explicit flush()."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    monkeypatch.setenv('METRICS_BUFFER_BYTES', '65536')
+    monkeypatch.setenv('METRICS_FLUSH_INTERVAL_MS', '50')
+    cfg = Config()
+    logger = get_logger(cfg)
+
+    # an idle worker's overdue buffer is written when another thread flushes
+    done = threading.Event()
+
+    def idle_worker():
+        logger.json_metric('idle', 1.0)
+        done.wait()
+
+    t = threading.Thread(target=idle_worker)
+    t.start()
+    logger.json_metric('main', 1.0)
+    time.sleep(0.06)
+    logger.json_metric('main', 2.0)
+    names = [json.loads(l)['metric_name'] for l in capsys.readouterr().out.strip().splitlines()]
+    assert names == ['idle', 'main', 'main']
+    done.set()
+    t.join()
+
+    # a finished worker's buffer is written once another thread starts buffering
+    t = threading.Thread(target=logger.json_metric, args=('finished', 1.0))
+    t.start()
+    t.join()
+    assert capsys.readouterr().out == ''
+    new = threading.Thread(target=logger.json_metric, args=('new', 1.0))
+    new.start()
+    new.join()
+    names = [json.loads(l)['metric_name'] for l in capsys.readouterr().out.strip().splitlines()]
+    assert names == ['finished']
+    logger.flush()
+    capsys.readouterr()
+
+
+def test_log_exception_appends_traceback(capsys, monkeypatch):
+    """Verify level='exception' appends the active traceback like logging.Logger.exception()."""
+    monkeypatch.delenv('LOG_LEVEL', raising=False)
+    logger = get_logger(Config())
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.log('job failed', level='exception')
+    logger.log('no exception', level='exception')
+    lines = capsys.readouterr().err.splitlines()
+    assert lines[0].endswith(' - ERROR - job failed | info=None')
+    assert lines[1] == 'Traceback (most recent call last):'
+    assert lines[-2] == 'ZeroDivisionError: division by zero'
+    assert lines[-1].endswith(' - ERROR - no exception | info=None')
+
+
+def test_json_metric_line_is_compact(capsys, monkeypatch):
+    """Verify metric lines use compact separators whichever JSON serializer is installed."""
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    logger = get_logger(Config())
+    logger.json_metric('compact', 1.0, info={'k': 'v'})
+    out = capsys.readouterr().out
+    assert '"event_type":"metric","info":{"k":"v"},' in out
+    assert '", "' not in out and '": ' not in out